@@ -0,0 +1,317 @@
+import numpy as np
+import typer
+from pydantic import BaseModel
+from engine import compile_formula_numpy
+from neo import driver, ConversionRelation
+from test_runner import DEFAULT_REL_TOL, DEFAULT_ABS_TOL
+from utils import console, benchmark
+
+#Sample inputs every formula is evaluated on
+SAMPLE_GRID = np.array([0.0, 0.001, 0.5, 1.0, 2.5, 10.0, 37.5, 100.0, 1234.5678])
+
+#Relative tolerance floor for round-trip and path checks. Their outputs can be huge (lightyears → meters),
+#where float rounding alone exceeds the absolute tolerance of run_formula_tests
+CONSISTENCY_REL_TOL = 1e-9
+
+
+class EdgeViolation(BaseModel):
+    from_unit: str
+    to_unit: str
+    formula: str
+    check: str      # "compile", "round_trip" or "path"
+    detail: str
+    conclusive: bool = True     # False when the evidence implicates several edges equally, such edges are never quarantined
+
+class AuditReport(BaseModel):
+    edges: int
+    round_trips_checked: int
+    paths_checked: int
+    violations: list[EdgeViolation]
+
+
+def load_edges(snapshot: str | None = None) -> list[ConversionRelation]:
+    """
+    Loads every CONVERTS_TO edge, either from Neo4j in one query or from a snapshot file written by snapshot.py
+    """
+    if snapshot:
+        from snapshot import read_relations
+        return list(read_relations(snapshot))
+
+    with driver.session() as session:
+        result = session.run("""
+            MATCH (a:Unit)-[r:CONVERTS_TO]->(b:Unit)
+            WHERE r.formula IS NOT NULL
+            RETURN a.name AS from_unit, b.name AS to_unit, r.formula AS formula
+        """)
+        return [ConversionRelation.model_validate(record.data()) for record in result]
+
+
+def _mismatched(actual: np.ndarray, expected: np.ndarray, rel_tol: float, abs_tol: float) -> np.ndarray:
+    """
+    Row-wise math.isclose over 2D arrays. A row fails if any sample differs beyond tolerance,
+    or is finite on one side only (e.g. a division by zero in just one of the two paths).
+    """
+    with np.errstate(all="ignore"):
+        finite = np.isfinite(actual) & np.isfinite(expected)
+        tolerance = np.maximum(rel_tol * np.maximum(np.abs(actual), np.abs(expected)), abs_tol)
+        outside = finite & (np.abs(actual - expected) > tolerance)
+    one_sided = np.isfinite(actual) != np.isfinite(expected)
+    return (outside | one_sided).any(axis=1)
+
+
+def audit_edges(
+    relations: list[ConversionRelation],
+    *,
+    rel_tol: float = DEFAULT_REL_TOL,
+    abs_tol: float = DEFAULT_ABS_TOL,
+    max_paths_per_edge: int = 3,
+) -> AuditReport:
+    """
+    Checks the whole graph for internal consistency:
+    - round trip: A→B followed by B→A must give back the input
+    - path: A→C must agree with A→B→C for up to max_paths_per_edge intermediate units B
+
+    Every formula is compiled once and evaluated once on SAMPLE_GRID. Path checks are grouped by
+    their second edge, so each formula is called once over all the inputs routed through it.
+    Both checks use at least CONSISTENCY_REL_TOL as relative tolerance.
+    """
+    grid = SAMPLE_GRID
+    rel_tol = max(rel_tol, CONSISTENCY_REL_TOL)
+    index: dict[tuple[str, str], int] = {}
+    fns = []
+    violations: list[EdgeViolation] = []
+    outputs = np.full((len(relations), len(grid)), np.nan)
+
+    def violation(i: int, check: str, detail: str, conclusive: bool = True) -> EdgeViolation:
+        r = relations[i]
+        return EdgeViolation(
+            from_unit=r.from_unit, to_unit=r.to_unit, formula=r.formula,
+            check=check, detail=detail, conclusive=conclusive,
+        )
+
+    # Compile and evaluate every formula once
+    with np.errstate(all="ignore"):
+        for i, relation in enumerate(relations):
+            index[(relation.from_unit, relation.to_unit)] = i
+            try:
+                input_var, fn = compile_formula_numpy(relation.formula)
+                outputs[i] = fn(grid)
+            except Exception as e:
+                fn = None
+                violations.append(violation(i, "compile", str(e)))
+            fns.append(fn)
+
+    valid = {key: i for key, i in index.items() if fns[i] is not None}
+
+    # Round trips, each unordered pair checked once
+    pairs = []
+    for (a, b), i in valid.items():
+        j = valid.get((b, a))
+        if j is not None and i < j:
+            pairs.append((i, j))
+
+    back = np.empty((len(pairs), len(grid)))
+    with np.errstate(all="ignore"):
+        for row, (i, j) in enumerate(pairs):
+            back[row] = fns[j](outputs[i])
+
+    expected = np.broadcast_to(grid, back.shape)
+    round_trip_failures = []
+    for row in np.flatnonzero(_mismatched(back, expected, rel_tol, abs_tol)):
+        i, j = pairs[row]
+        a, b = relations[i].from_unit, relations[i].to_unit
+        detail = f"{a} → {b} → {a} does not return the input (max error {np.nanmax(np.abs(back[row] - grid)):.6g})"
+        round_trip_failures.append((i, j, detail))
+
+    # Path triangles: (direct A→C, first leg A→B, second leg B→C)
+    successors: dict[str, list[tuple[str, int]]] = {}
+    for (a, b), i in valid.items():
+        successors.setdefault(a, []).append((b, i))
+
+    triangles = []
+    for (a, c), direct in valid.items():
+        found = 0
+        for b, first in successors.get(a, []):
+            if found >= max_paths_per_edge:
+                break
+            second = valid.get((b, c))
+            if b == c or second is None:
+                continue
+            triangles.append((direct, first, second))
+            found += 1
+
+    failed = np.empty((0, 3), dtype=int)
+    if triangles:
+        triangles = np.array(triangles)
+        composed = np.empty((len(triangles), len(grid)))
+
+        # One call per second-leg formula over every input routed through it
+        order = np.argsort(triangles[:, 2], kind="stable")
+        legs, starts = np.unique(triangles[order, 2], return_index=True)
+        with np.errstate(all="ignore"):
+            for leg, rows in zip(legs, np.split(order, starts[1:])):
+                composed[rows] = fns[leg](outputs[triangles[rows, 1]])
+
+        failed = triangles[_mismatched(composed, outputs[triangles[:, 0]], rel_tol, abs_tol)]
+
+    blame_counts = np.bincount(failed.ravel(), minlength=len(relations))
+
+    # A failed round trip implicates both edges of the pair equally. Path failures decide between them:
+    # the edge on strictly more failing paths is blamed, otherwise both are flagged as inconclusive
+    explained: set[int] = set()
+    for i, j, detail in round_trip_failures:
+        if blame_counts[i] == blame_counts[j]:
+            violations.append(violation(i, "round_trip", detail, conclusive=False))
+            violations.append(violation(j, "round_trip", detail, conclusive=False))
+            continue
+        culprit, other = (i, j) if blame_counts[i] > blame_counts[j] else (j, i)
+        explained.add(culprit)
+        detail += f", on {blame_counts[culprit]} inconsistent path(s) vs {blame_counts[other]} for its inverse"
+        violations.append(violation(culprit, "round_trip", detail))
+
+    # Blame per failing triangle: a round-trip culprit explains it, otherwise the one edge appearing in
+    # strictly the most failing triangles. On a tie all three are flagged as inconclusive
+    blamed: dict[int, list[str]] = {}
+    inconclusive: dict[int, list[str]] = {}
+    for direct, first, second in failed:
+        edges = (int(direct), int(first), int(second))
+        path = f"{relations[direct].from_unit} → {relations[first].to_unit} → {relations[direct].to_unit}"
+
+        if any(e in explained for e in edges):
+            continue
+
+        counts = sorted((blame_counts[e] for e in edges), reverse=True)
+        if counts[0] > counts[1]:
+            blamed.setdefault(max(edges, key=lambda e: blame_counts[e]), []).append(path)
+        else:
+            for e in edges:
+                inconclusive.setdefault(e, []).append(path)
+
+    for edge, paths in blamed.items():
+        detail = f"inconsistent with {len(paths)} path(s), e.g. {paths[0]}"
+        violations.append(violation(edge, "path", detail))
+
+    for edge, paths in inconclusive.items():
+        if edge in blamed:
+            continue
+        detail = f"on {len(paths)} inconsistent path(s) without a single culprit, e.g. {paths[0]}"
+        violations.append(violation(edge, "path", detail, conclusive=False))
+
+    return AuditReport(
+        edges=len(relations),
+        round_trips_checked=len(pairs),
+        paths_checked=len(triangles),
+        violations=violations,
+    )
+
+
+def mark_violations(violations: list[EdgeViolation], status: str = "flagged", batch_size: int = 5000) -> int:
+    """
+    Writes audit_status and audit_reason onto every violating edge in UNWIND batches.
+    With status "quarantined", only edges with conclusive evidence are quarantined, the rest are flagged.
+    An existing quarantine is never downgraded, only clear_passing and store_conversion lift it.
+    Edges marked "quarantined" are skipped by lookup_conversion and warm starts.
+    Returns the number of edges marked.
+    """
+    reasons: dict[tuple[str, str], list[str]] = {}
+    conclusive: set[tuple[str, str]] = set()
+    for v in violations:
+        reasons.setdefault((v.from_unit, v.to_unit), []).append(f"{v.check}: {v.detail}")
+        if v.conclusive:
+            conclusive.add((v.from_unit, v.to_unit))
+
+    rows = [
+        {
+            "from_unit": a,
+            "to_unit": b,
+            "reason": "; ".join(r),
+            "status": status if status != "quarantined" or (a, b) in conclusive else "flagged",
+        }
+        for (a, b), r in reasons.items()
+    ]
+
+    with driver.session() as session:
+        for start in range(0, len(rows), batch_size):
+            session.run("""
+                UNWIND $rows AS row
+                MATCH (:Unit {name: row.from_unit})-[r:CONVERTS_TO]->(:Unit {name: row.to_unit})
+                SET r.audit_status = CASE WHEN r.audit_status = "quarantined" THEN r.audit_status ELSE row.status END,
+                    r.audit_reason = row.reason
+            """, rows=rows[start:start + batch_size])
+
+    return len(rows)
+
+
+def clear_passing(violations: list[EdgeViolation], batch_size: int = 5000) -> int:
+    """
+    Removes audit_status and audit_reason from previously marked edges that no longer violate anything.
+    Returns the number of edges cleared.
+    """
+    violating = {(v.from_unit, v.to_unit) for v in violations}
+
+    with driver.session() as session:
+        result = session.run("""
+            MATCH (a:Unit)-[r:CONVERTS_TO]->(b:Unit)
+            WHERE r.audit_status IS NOT NULL
+            RETURN a.name AS from_unit, b.name AS to_unit
+        """)
+        rows = [
+            {"from_unit": record["from_unit"], "to_unit": record["to_unit"]}
+            for record in result
+            if (record["from_unit"], record["to_unit"]) not in violating
+        ]
+
+        for start in range(0, len(rows), batch_size):
+            session.run("""
+                UNWIND $rows AS row
+                MATCH (:Unit {name: row.from_unit})-[r:CONVERTS_TO]->(:Unit {name: row.to_unit})
+                REMOVE r.audit_status, r.audit_reason
+            """, rows=rows[start:start + batch_size])
+
+    return len(rows)
+
+
+def audit(
+    snapshot: str = typer.Option(None, help="Audit a snapshot file instead of the live graph"),
+    mark: str = typer.Option("none", help="What to do with violating edges: none, flagged or quarantined"),
+    abs_tol: float = DEFAULT_ABS_TOL,
+    rel_tol: float = DEFAULT_REL_TOL,
+    max_paths_per_edge: int = 3,
+) -> None:
+    """
+    Audit every CONVERTS_TO edge for round-trip and path consistency
+    """
+    if mark not in ("none", "flagged", "quarantined"):
+        raise typer.BadParameter("mark must be one of: none, flagged, quarantined")
+
+    with benchmark("Load edges"):
+        relations = load_edges(snapshot)
+
+    with benchmark("Audit"):
+        report = audit_edges(relations, rel_tol=rel_tol, abs_tol=abs_tol, max_paths_per_edge=max_paths_per_edge)
+
+    console.print(
+        f"Audited {report.edges} edges: {report.round_trips_checked} round trips, "
+        f"{report.paths_checked} paths, {len(report.violations)} violations"
+    )
+    for v in report.violations:
+        suffix = "" if v.conclusive else ", inconclusive"
+        console.print(f"[{v.check}] {v.from_unit} → {v.to_unit}: {v.formula} ({v.detail}{suffix})")
+
+    if mark == "none":
+        return
+    if snapshot:
+        console.print("Audit results for a snapshot are not written back to the graph")
+        return
+
+    if report.violations:
+        count = mark_violations(report.violations, status=mark)
+        console.print(f"Marked {count} edges as {mark} (inconclusive ones only as flagged)")
+
+    cleared = clear_passing(report.violations)
+    console.print(f"Cleared audit status on {cleared} edges that now pass")
+    console.print("Running servers keep cached formulas until POST /cache/clear is called or they restart")
+
+
+if __name__ == "__main__":
+    typer.run(audit)
@@ -3,10 +3,11 @@ import json
 from typing import Dict, List
 from pydantic import BaseModel
 from utils import console
+from llm_scheduler import ScheduledLM
 
 
 dspy.configure(
-    lm=dspy.LM(
+    lm=ScheduledLM(
         model="openai/gpt-4o-mini",
     )
 )
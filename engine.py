@@ -1,6 +1,17 @@
-from sympy import symbols, sympify, Eq, solve
+from sympy import symbols, sympify, Eq, solve, lambdify
+from functools import lru_cache
+import ast
 import re
 
+#AST nodes allowed in formulas compiled straight to Python bytecode by compile_formula_numpy
+SAFE_NODES = (
+    ast.Expression, ast.BinOp, ast.UnaryOp, ast.Constant, ast.Name, ast.Load,
+    ast.Add, ast.Sub, ast.Mult, ast.Div, ast.Pow, ast.USub, ast.UAdd,
+)
+
+#Names SymPy reads as constants rather than variables, these formulas always go through SymPy
+SYMPY_CONSTANTS = {"pi", "E", "I", "oo"}
+
 #Regex pattern to match variable names with spaces so that they can be replaced with underscores
 VARIABLE_PATTERN = re.compile(
     r'\b([a-zA-Z]+(?:\s+[a-zA-Z]+)+)\b'
@@ -61,6 +72,78 @@ def evaluate_formula(formula: str, **inputs) -> float:        #Takes in a formul
     return float(result)
 
 
+@lru_cache(maxsize=4096)
+def compile_formula(formula: str):
+    """
+    Parses a stored formula once and compiles its RHS into a plain Python callable.
+    Compiled formulas are cached, so a long-running process only pays the SymPy cost once per formula.
+
+    Returns:
+        input_var, fn -> fn(value) gives the converted value
+    """
+    formula = normalize_variables(formula)
+    lhs_str, lhs, rhs_expr = parse_formula(formula)
+
+    rhs_vars = list(rhs_expr.free_symbols)
+
+    if len(rhs_vars) != 1:
+        raise ValueError(f"Formula must contain exactly one RHS variable. Got: {rhs_vars}")
+
+    input_sym = rhs_vars[0]
+    return input_sym.name, lambdify(input_sym, rhs_expr, modules="math")
+
+
+def compile_formula_numpy(formula: str):
+    """
+    Compiles a formula into a callable that accepts NumPy arrays, for bulk evaluation.
+    Plain arithmetic RHS expressions are compiled directly with Python's compiler, which is far
+    cheaper than SymPy. Anything else falls back to SymPy's lambdify.
+
+    Returns:
+        input_var, fn -> fn(np.ndarray) gives the converted array
+    """
+    formula = normalize_variables(formula)
+    lhs_str, rhs_str = formula.split("=")
+    rhs_str = rhs_str.strip().replace('×','*').replace("÷", "/").replace("^", "**")
+
+    try:
+        tree = ast.parse(rhs_str, mode="eval")
+    except SyntaxError:
+        tree = None
+
+    names = set()
+    for node in ast.walk(tree) if tree is not None else ():
+        if not isinstance(node, SAFE_NODES):
+            break
+        if isinstance(node, ast.Name):
+            names.add(node.id)
+    else:
+        if tree is not None and len(names) == 1 and not names & SYMPY_CONSTANTS:
+            input_var = names.pop()
+            code = compile(tree, "<formula>", "eval")
+            return input_var, lambda values: eval(code, {"__builtins__": {}}, {input_var: values})
+
+    lhs_str, lhs, rhs_expr = parse_formula(formula)
+    rhs_vars = list(rhs_expr.free_symbols)
+
+    if len(rhs_vars) != 1:
+        raise ValueError(f"Formula must contain exactly one RHS variable. Got: {rhs_vars}")
+
+    return rhs_vars[0].name, lambdify(rhs_vars[0], rhs_expr, modules="numpy")
+
+
+def convert_value(formula: str, value: float) -> float:
+    """
+    Applies a stored conversion formula to a single numeric value.
+
+    Example:
+       convert_value("centimeters = meters * 100", 5)
+       → returns 500.0
+    """
+    input_var, fn = compile_formula(formula)
+    return float(fn(value))
+
+
 def invert_formula(formula: str) -> str:
     """
     Takes a formula like:
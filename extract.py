@@ -1,18 +1,36 @@
 import dspy
+import re
 from dotenv import load_dotenv
-from pydantic import BaseModel, field_validator
-from typing import Optional
+from pydantic import BaseModel, field_validator, ValidationError
+from typing import Optional, Callable
 from utils import console
+from llm_scheduler import ScheduledLM
 
 load_dotenv()
 
 dspy.configure(
-    lm=dspy.LM(
+    lm=ScheduledLM(
         model="openai/gpt-4o-mini",
     )
 )
 
 
+#Matches a standalone number, e.g. "5", "-40", "2.5", "1,000", "3e8". Digits glued to a comma, slash or
+#other digits ("1,5", "1/2", "1,5000") never match, so ambiguous notations can't be read as a different number
+VALUE_PATTERN = re.compile(
+    r'(?<![\w.,/])[-+]?(?:(?:\d{1,3}(?:,\d{3})+|\d+)(?:\.\d+)?|\.\d+)(?:[eE][-+]?\d+)?(?!\d|[.,]\d|\s*/)'
+)
+
+#Fractions such as "1/2" or "3 / 4"
+FRACTION_PATTERN = re.compile(r'\d\s*/\s*\.?\d')
+
+
+#Rough output token cost of one item in a batched call, used to size batches to the LM token limit
+FORMULA_TOKENS_PER_ITEM = 60
+TEST_CASE_TOKENS_PER_ITEM = 350     # 10 test cases plus its share of the chain of thought
+BATCH_TOKEN_RESERVE = 500           # Field headers, reasoning preamble and completion marker
+
+
 #Pydantics Models
 class ExtractedUnits(BaseModel):
     from_unit: str
@@ -48,6 +66,24 @@ class ExtractUnits(dspy.Module):
         return cleaned_units
 
 
+def extract_value(question: str) -> float | None:
+    """
+    Pulls the numeric value to be converted out of a question without an LLM call.
+    "convert 5 meters to centimeters" → 5.0, "meters to centimeters" → None
+
+    Returns None whenever the value is ambiguous (fractions, decimal commas, or more than one number),
+    so callers never evaluate a formula on a misread value.
+    """
+    if FRACTION_PATTERN.search(question):
+        return None
+
+    matches = VALUE_PATTERN.findall(question)
+    if len(matches) != 1:
+        return None
+
+    return float(matches[0].replace(",", ""))
+
+
 class ConversionValidator(dspy.Module):
     class ConversionValiditySignature(dspy.Signature):
         """
@@ -210,3 +246,188 @@ class AskFormula(dspy.Module):
         # Validate output after LLM prediction
         validated = FormulaResult.model_validate(raw_predicted_formula.toDict())
         return validated
+
+
+def batch_size_for(tokens_per_item: int, max_batch: int = 50) -> int:
+    """
+    Largest batch whose expected output fits in the configured LM's max_tokens.
+    """
+    lm = dspy.settings.lm
+    max_tokens = getattr(lm, "kwargs", {}).get("max_tokens") or 4000
+    return max(1, min(max_batch, (max_tokens - BATCH_TOKEN_RESERVE) // tokens_per_item))
+
+
+def is_truncated_output_error(e: Exception) -> bool:
+    # DSPy raises AdapterParseError when a response is cut off before every output field was written
+    return type(e).__name__ == "AdapterParseError"
+
+
+def run_in_batches(module: dspy.Module, items: list, predict_chunk: Callable, validate_item: Callable) -> list:
+    """
+    Runs predict_chunk over items in chunks of module.batch_size and validates every returned item on its own.
+    Items that fail validation or belong to a failed call come back as None so the caller can retry
+    them on the single-pair path.
+
+    Only a short or truncated response halves module.batch_size, and the cut-off chunk is run again at the
+    smaller size. Other failures (rate limits, auth, network) leave it alone, and every complete chunk grows
+    it back towards module.max_batch_size.
+    """
+    results = []
+    start = 0
+    while start < len(items):
+        chunk = items[start:start + module.batch_size]
+        start += len(chunk)
+        truncated = False
+
+        try:
+            outputs = list(predict_chunk(chunk))
+            truncated = len(outputs) < len(chunk)
+        except Exception as e:
+            console.print(f"Batched call for {len(chunk)} items failed:", e)
+            outputs = []
+            truncated = is_truncated_output_error(e)
+
+        if truncated:
+            module.batch_size = max(1, module.batch_size // 2)
+            if len(chunk) > 1:
+                start -= len(chunk)
+                continue
+        elif len(outputs) == len(chunk):
+            module.batch_size = min(module.max_batch_size, module.batch_size + max(1, module.batch_size // 4))
+
+        for i, item in enumerate(chunk):
+            try:
+                results.append(validate_item(item, outputs[i]) if i < len(outputs) else None)
+            except (ValidationError, ValueError, TypeError, KeyError, AttributeError):
+                results.append(None)
+
+    return results
+
+
+def _same_formula(a: str, b: str) -> bool:
+    return "".join(a.split()) == "".join(b.split())
+
+
+class AskFormulaBatch(dspy.Module):
+
+    class FormulaBatchSignature(dspy.Signature):
+        """
+        Task: For EACH unit pair, decide whether the conversion is possible and, if it is,
+        generate the mathematical formula for converting from_unit into to_unit.
+
+        Return exactly one object per unit pair, in the same order, with keys:
+        - from_unit: copied unchanged from the input pair
+        - to_unit: copied unchanged from the input pair
+        - valid: false if the units are unrelated concepts (e.g. "meters" → "seconds", "sheep" → "goats"), else true
+        - formula: the conversion formula, or "" when valid is false
+
+        Formula rules:
+        1. Always use FULL unit names (e.g., "meters per second", never "m/s").
+        2. Never abbreviate unit names.
+        3. Use only:
+        - '*' for multiplication
+        - '/' for division
+        - '**' for exponentiation
+        4. Minimize the number of mathematical operations.
+        5. The equation MUST be in the form:
+        to_unit = <expression involving from_unit>
+        6. The left-hand side (LHS) must always be the to_unit.
+        7. If the spelling for units have british and american variations, use british spelling.
+        8. Unit names must be in plural form (e.g., "meters", "inches").
+        """
+
+        unit_pairs: list[ExtractedUnits] = dspy.InputField(
+            desc="Unit pairs to convert, each with full from_unit and to_unit names"
+        )
+
+        formulas: list[dict] = dspy.OutputField(
+            desc="One {from_unit, to_unit, valid, formula} object per input pair, in input order"
+        )
+
+    def __init__(self, max_batch: int = 50) -> None:
+        super().__init__()
+        self.predict = dspy.Predict(self.FormulaBatchSignature)
+        self.max_batch_size = batch_size_for(FORMULA_TOKENS_PER_ITEM, max_batch)
+        self.batch_size = self.max_batch_size
+
+    @staticmethod
+    def validate_item(units: ExtractedUnits, item: dict) -> FormulaResult | bool | None:
+        # The echoed pair guards against the model shifting or reordering items
+        if (item["from_unit"].lower().strip(), item["to_unit"].lower().strip()) != (
+            units.from_unit.lower().strip(), units.to_unit.lower().strip()
+        ):
+            return None
+        # Anything but a real bool (e.g. the string "false") or a formula without "=" is unusable
+        if not isinstance(item.get("valid"), bool):
+            return None
+        if not item["valid"]:
+            return False
+        lhs, equals, rhs = str(item.get("formula") or "").partition("=")
+        if not (equals and lhs.strip() and rhs.strip()):
+            return None
+        return FormulaResult.model_validate(item)
+
+    def forward(self, units_list: list[ExtractedUnits]) -> list[FormulaResult | bool | None]:
+        """
+        Returns one entry per pair: a FormulaResult, False if the conversion is not possible,
+        or None if the batched answer was unusable and the pair should go through AskFormula.
+        """
+        return run_in_batches(
+            self,
+            units_list,
+            lambda chunk: self.predict(unit_pairs=chunk).formulas,
+            self.validate_item,
+        )
+
+
+class FormulaTestCaseBatchGenerator(dspy.Module):
+
+    class FormulaTestCaseBatchSignature(dspy.Signature):
+        """
+        Task: For EACH unit conversion formula, generate exactly 10 numerical test cases.
+
+        Return exactly one object per formula, in the same order, with keys:
+        - formula: copied unchanged from the input
+        - test_cases: exactly 10 objects with input_value (float) and expected_output (float)
+
+        For each formula try to cover: baseline value, standard value, fractional value, zero,
+        decimal input, very small input, high precision input, negative value, large value,
+        and an edge case relevant to the formula.
+
+        Constraints:
+        - Generate EXACTLY 10 test cases per formula.
+        - Ensure high precision for 'expected_output'.
+        - If the unit represents a physical quantity that cannot be negative (e.g., length, mass), do not generate negative inputs.
+        - Return raw floats, no units strings.
+        """
+
+        formulas: list[str] = dspy.InputField(
+            desc="Unit conversion formulas, e.g. 'centimeters = meters * 100'"
+        )
+
+        test_case_sets: list[dict] = dspy.OutputField(
+            desc="One {formula, test_cases} object per input formula, in input order"
+        )
+
+    def __init__(self, max_batch: int = 50) -> None:
+        super().__init__()
+        self.generate = dspy.ChainOfThought(self.FormulaTestCaseBatchSignature)
+        self.max_batch_size = batch_size_for(TEST_CASE_TOKENS_PER_ITEM, max_batch)
+        self.batch_size = self.max_batch_size
+
+    @staticmethod
+    def validate_item(formula: str, item: dict) -> TestCaseSet | None:
+        if not _same_formula(item["formula"], formula):
+            return None
+        return TestCaseSet.model_validate(item)
+
+    def forward(self, formulas: list[str]) -> list[TestCaseSet | None]:
+        """
+        Returns one TestCaseSet per formula, or None where the batched answer was unusable.
+        """
+        return run_in_batches(
+            self,
+            formulas,
+            lambda chunk: self.generate(formulas=chunk).test_case_sets,
+            self.validate_item,
+        )
@@ -0,0 +1,101 @@
+import asyncio
+import random
+import re
+import time
+import typer
+from aiohttp import web
+
+#DSPy's ChatAdapter ends each prompt with "Respond with the corresponding output fields, starting with the field `[[ ## x ## ]]`, ..."
+FIELD_PATTERN = re.compile(r"\[\[ ## (\w+) ## \]\]")
+
+
+def create_app(
+    throttle_rate: float = 0.2,
+    max_concurrent: int = 4,
+    latency: float = 0.2,
+    retry_after: float | None = None,
+    reply: str = "1",
+) -> web.Application:
+    """
+    OpenAI-compatible /v1/chat/completions endpoint for exercising the LLM scheduler without a provider.
+
+    :param throttle_rate: Probability of answering any request with a 429
+    :param max_concurrent: Requests beyond this many in flight always get a 429
+    :param latency: Seconds each successful request takes
+    :param retry_after: Retry-After header sent with 429s, if set
+    :param reply: Value written into every output field DSPy asks for
+    """
+    state = {"in_flight": 0, "requests": 0, "throttled": 0}
+
+    def throttle() -> web.Response:
+        state["throttled"] += 1
+        headers = {"Retry-After": str(retry_after)} if retry_after is not None else None
+        return web.json_response(
+            {"error": {"message": "Rate limit exceeded", "type": "rate_limit_error", "code": "rate_limit_exceeded"}},
+            status=429,
+            headers=headers,
+        )
+
+    async def chat_completions(request: web.Request) -> web.Response:
+        state["requests"] += 1
+        body = await request.json()
+
+        if state["in_flight"] >= max_concurrent or random.random() < throttle_rate:
+            return throttle()
+
+        state["in_flight"] += 1
+        try:
+            await asyncio.sleep(latency)
+        finally:
+            state["in_flight"] -= 1
+
+        prompt = body["messages"][-1]["content"]
+        if isinstance(prompt, list):
+            prompt = " ".join(part.get("text", "") for part in prompt)
+        instructions = prompt[prompt.rfind("Respond with"):]
+        fields = [f for f in dict.fromkeys(FIELD_PATTERN.findall(instructions)) if f != "completed"]
+        content = "".join(f"[[ ## {field} ## ]]\n{reply}\n\n" for field in fields) + "[[ ## completed ## ]]"
+
+        return web.json_response({
+            "id": f"fake-{state['requests']}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": body.get("model", "fake"),
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+            "usage": {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0},
+        })
+
+    async def stats(request: web.Request) -> web.Response:
+        return web.json_response(state)
+
+    app = web.Application()
+    app.add_routes([
+        web.post("/v1/chat/completions", chat_completions),
+        web.get("/stats", stats),
+    ])
+    return app
+
+
+def serve(
+    port: int = 8001,
+    throttle_rate: float = 0.2,
+    max_concurrent: int = 4,
+    latency: float = 0.2,
+    retry_after: float = typer.Option(None, help="Retry-After header sent with 429s, if set"),
+    reply: str = "1",
+) -> None:
+    """
+    Run a fake OpenAI endpoint that injects 429s. Point the app at it with LLM_API_BASE=http://127.0.0.1:8001/v1
+    """
+    app = create_app(
+        throttle_rate=throttle_rate,
+        max_concurrent=max_concurrent,
+        latency=latency,
+        retry_after=retry_after,
+        reply=reply,
+    )
+    web.run_app(app, host="127.0.0.1", port=port)
+
+
+if __name__ == "__main__":
+    typer.run(serve)
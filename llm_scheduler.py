@@ -0,0 +1,254 @@
+import asyncio
+import functools
+import heapq
+import itertools
+import os
+import random
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from enum import IntEnum
+import dspy
+from utils import console
+
+
+class Priority(IntEnum):
+    """
+    Lower values are scheduled first.
+    """
+    INTERACTIVE = 0     # cli.py and single /convert queries
+    BATCH = 1           # /convert/batch
+    BACKGROUND = 2      # training and backfills
+
+
+#Priority of LLM calls made from the current thread / task. Copied into asyncio.to_thread workers automatically
+_current_priority: ContextVar[Priority] = ContextVar("llm_priority", default=Priority.INTERACTIVE)
+
+
+@contextmanager
+def llm_priority(level: Priority):
+    """
+    Runs every LLM call inside the block at the given priority.
+    """
+    token = _current_priority.set(level)
+    try:
+        yield
+    finally:
+        _current_priority.reset(token)
+
+
+class TokenBucket:
+    """
+    Classic token bucket: refills at `rate` tokens per second up to `capacity`.
+    Not thread-safe on its own, LLMScheduler only touches it while holding its lock.
+    """
+    def __init__(self, rate: float, capacity: float) -> None:
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def try_acquire(self) -> float:
+        """
+        Takes one token if available and returns 0, otherwise returns the seconds until one is.
+        """
+        self._refill()
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    def drain(self) -> None:
+        # After a 429 nobody should fire again until the bucket has refilled a bit
+        self._refill()
+        self.tokens = min(self.tokens, 0.0)
+
+
+def is_rate_limit_error(e: Exception) -> bool:
+    return getattr(e, "status_code", None) == 429 or "RateLimit" in type(e).__name__
+
+
+def is_transient_error(e: Exception) -> bool:
+    if isinstance(e, (TimeoutError, ConnectionError)):
+        return True
+    if getattr(e, "status_code", None) in (408, 500, 502, 503, 504):
+        return True
+    return type(e).__name__ in ("APIConnectionError", "Timeout", "APITimeoutError", "ServiceUnavailableError", "InternalServerError")
+
+
+def retry_after_seconds(e: Exception) -> float | None:
+    headers = getattr(getattr(e, "response", None), "headers", None) or {}
+    try:
+        return float(headers.get("retry-after"))
+    except (TypeError, ValueError):
+        return None
+
+
+class LLMScheduler:
+    """
+    Gate in front of every LLM call in the process:
+    - a token bucket caps the request rate
+    - an AIMD concurrency limit grows by ~1 per round of successful calls and halves on a 429
+      (shrinks by 20% when latency goes above target_latency). It is cut at most once per congestion window:
+      only calls started after the last cut can cut it again, so a burst of simultaneous 429s counts once
+    - waiting calls are released strictly by priority, then arrival order
+    - rate limited and transient failures are retried with full-jitter exponential backoff
+    """
+    def __init__(
+        self,
+        requests_per_second: float = 5.0,
+        burst: float = 10.0,
+        min_concurrency: int = 1,
+        max_concurrency: int = 16,
+        initial_concurrency: int = 4,
+        target_latency: float = 15.0,
+        max_retries: int = 5,
+        base_delay: float = 0.5,
+        max_delay: float = 30.0,
+    ) -> None:
+        self.bucket = TokenBucket(requests_per_second, burst)
+        self.min_concurrency = min_concurrency
+        self.max_concurrency = max_concurrency
+        self.limit = float(initial_concurrency)
+        self.target_latency = target_latency
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+        self._cond = threading.Condition()
+        self._queue: list[tuple[int, int]] = []
+        self._seq = itertools.count()
+        self._in_flight = 0
+        self._last_cut = float("-inf")     # time.monotonic() of the last concurrency cut
+
+        self.calls = 0
+        self.throttled = 0
+        self.retries = 0
+        self.failures = 0
+
+    @classmethod
+    def from_env(cls) -> "LLMScheduler":
+        return cls(
+            requests_per_second=float(os.environ.get("LLM_REQUESTS_PER_SECOND", 5.0)),
+            burst=float(os.environ.get("LLM_BURST", 10.0)),
+            max_concurrency=int(os.environ.get("LLM_MAX_CONCURRENCY", 16)),
+        )
+
+    def __deepcopy__(self, memo) -> "LLMScheduler":
+        # dspy copies LMs with deepcopy; every copy must keep sharing the same scheduler
+        return self
+
+    def _acquire(self, priority: int) -> None:
+        with self._cond:
+            ticket = (priority, next(self._seq))
+            heapq.heappush(self._queue, ticket)
+            while True:
+                if self._queue[0] == ticket and self._in_flight < int(self.limit):
+                    wait = self.bucket.try_acquire()
+                    if wait == 0:
+                        heapq.heappop(self._queue)
+                        self._in_flight += 1
+                        self._cond.notify_all()
+                        return
+                    self._cond.wait(wait)
+                else:
+                    self._cond.wait()
+
+    def _release(self, started: float, throttled: bool, outcome: str) -> None:
+        with self._cond:
+            latency = time.monotonic() - started
+            self._in_flight -= 1
+            self.calls += 1
+            self.throttled += throttled
+            self.retries += outcome == "retry"
+            self.failures += outcome == "failed"
+
+            if throttled:
+                self.bucket.drain()
+
+            congested = throttled or latency > self.target_latency
+            if congested and started > self._last_cut:
+                factor = 0.5 if throttled else 0.8
+                self.limit = max(self.min_concurrency, self.limit * factor)
+                self._last_cut = time.monotonic()
+            elif outcome == "ok":
+                self.limit = min(self.max_concurrency, self.limit + 1 / self.limit)
+            self._cond.notify_all()
+
+    def call(self, fn, *args, priority: Priority | None = None, **kwargs):
+        """
+        Runs fn(*args, **kwargs) once a slot and a rate token are free, retrying throttled and transient failures.
+        Priority defaults to the one set with llm_priority() for the current context.
+        """
+        level = int(priority if priority is not None else _current_priority.get())
+
+        for attempt in range(self.max_retries + 1):
+            self._acquire(level)
+            started = time.monotonic()
+            throttled = False
+            outcome = "ok"
+            try:
+                return fn(*args, **kwargs)
+            except Exception as e:
+                throttled = is_rate_limit_error(e)
+                if not (throttled or is_transient_error(e)) or attempt == self.max_retries:
+                    outcome = "failed"
+                    raise
+                outcome = "retry"
+                retry_after = retry_after_seconds(e)
+                if retry_after is not None:
+                    delay = min(self.max_delay, max(0.0, retry_after))
+                else:
+                    delay = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+                console.print(f"LLM call failed ({type(e).__name__}), retrying in {delay:.2f}s")
+            finally:
+                self._release(started, throttled, outcome)
+            time.sleep(delay)
+
+    def stats(self) -> dict:
+        with self._cond:
+            return {
+                "concurrency_limit": self.limit,
+                "in_flight": self._in_flight,
+                "waiting": len(self._queue),
+                "calls": self.calls,
+                "throttled": self.throttled,
+                "retries": self.retries,
+                "failures": self.failures,
+            }
+
+
+#One scheduler per process, shared by every module's LM
+scheduler = LLMScheduler.from_env()
+
+
+class ScheduledLM(dspy.LM):
+    """
+    dspy.LM whose provider requests all go through an LLMScheduler. Only the completion call itself is
+    scheduled: DSPy's request cache wraps it, so cache hits never take a rate token or a concurrency slot.
+    Retries are left to the scheduler, so litellm's own retries are turned off.
+    """
+    def __init__(self, model: str, scheduler: LLMScheduler = scheduler, **kwargs) -> None:
+        kwargs.setdefault("num_retries", 0)
+        if os.environ.get("LLM_API_BASE"):
+            kwargs.setdefault("api_base", os.environ["LLM_API_BASE"])  # e.g. the local fake_llm.py endpoint
+        super().__init__(model, **kwargs)
+        self.scheduler = scheduler
+
+    def _get_cached_completion_fn(self, completion_fn, cache):
+        # wraps() keeps the function's module/qualname, which DSPy uses in its cache key
+        @functools.wraps(completion_fn)
+        def scheduled_completion(*args, **kwargs):
+            return self.scheduler.call(completion_fn, *args, **kwargs)
+
+        return super()._get_cached_completion_fn(scheduled_completion, cache)
+
+    async def aforward(self, prompt=None, messages=None, **kwargs):
+        # The scheduler is thread based, so async calls take the sync path in a worker thread
+        return await asyncio.to_thread(self.forward, prompt=prompt, messages=messages, **kwargs)
@@ -25,12 +25,49 @@ class ConversionRelation(BaseModel):
     def normalize_units(cls, v: str) -> str:
         return v.lower().strip()
 
+#In-process formula cache keyed by (from_unit, to_unit). Filled by lookups, stores and snapshot warm starts
+_conversion_cache: dict[tuple[str, str], str] = {}
+
+
+def warm_cache(relations) -> int:
+    """
+    Loads ConversionRelations straight into the in-process lookup cache, bypassing Neo4j.
+    Edges quarantined by the audit are skipped. Returns the number of formulas cached.
+    """
+    count = 0
+    for relation in relations:
+        if (relation.model_extra or {}).get("audit_status") == "quarantined":
+            continue
+        _conversion_cache[(relation.from_unit, relation.to_unit)] = relation.formula
+        count += 1
+    return count
+
+
+def clear_cache(pairs: list[tuple[str, str]] | None = None) -> int:
+    """
+    Drops formulas from the in-process lookup cache, e.g. after the audit quarantined them,
+    so the next lookup goes back to Neo4j. Clears everything when no (from_unit, to_unit) pairs are given.
+    Returns the number of formulas dropped.
+    """
+    if pairs is None:
+        count = len(_conversion_cache)
+        _conversion_cache.clear()
+        return count
+
+    return sum(_conversion_cache.pop((a.lower().strip(), b.lower().strip()), None) is not None for a, b in pairs)
+
+
 #To Check if the unit conversion exists in the knowledge base, returns Formula or None
 def lookup_conversion(units: ExtractedUnits) -> str | None:
+    key = (units.from_unit.lower(), units.to_unit.lower())
+    if key in _conversion_cache:
+        return _conversion_cache[key]
+
     with driver.session() as session:
         result = session.run(
             """
             MATCH (a:Unit {name: $unit1})-[r:CONVERTS_TO]->(b:Unit {name: $unit2})
+            WHERE coalesce(r.audit_status, "") <> "quarantined"
             RETURN r.formula AS formula
             """,
             unit1=units.from_unit.lower(),
@@ -38,10 +75,14 @@ def lookup_conversion(units: ExtractedUnits) -> str | None:
         )
 
         record = result.single()
-        return record["formula"] if record else None
+        if not record:
+            return None
+
+        _conversion_cache[key] = record["formula"]
+        return record["formula"]
 
 
-#To Store a new conversion between two units
+#To Store a new conversion between two units. A freshly stored formula replaces any audit verdict on the old one
 def store_conversion(relation: ConversionRelation):
     console.print(relation)
     with driver.session() as session:
@@ -54,11 +95,13 @@ def store_conversion(relation: ConversionRelation):
             MERGE (b:Unit {name: $unit2})
             MERGE (a)-[r:CONVERTS_TO]->(b)
             SET r += $props
+            REMOVE r.audit_status, r.audit_reason
         """, 
         unit1=relation.from_unit,
         unit2=relation.to_unit,
         props=props
         )
+        _conversion_cache[(relation.from_unit, relation.to_unit)] = relation.formula
         console.print(f"Forward stored: {relation.from_unit} → {relation.to_unit}")
 
 
@@ -84,9 +127,11 @@ def store_conversion(relation: ConversionRelation):
             MERGE (b:Unit {name: $unit2})
             MERGE (a)-[r:CONVERTS_TO]->(b)
             SET r.formula = $inverse_formula
+            REMOVE r.audit_status, r.audit_reason
         """,
         unit1=relation.to_unit,
         unit2=relation.from_unit,
         inverse_formula=inverse_formula)
 
+        _conversion_cache[(relation.to_unit, relation.from_unit)] = inverse_formula
         console.print(f"Inverse stored: {relation.to_unit} → {relation.from_unit}: {inverse_formula}")
@@ -0,0 +1,199 @@
+import asyncio
+import time
+import typer
+from aiohttp import web
+from pydantic import BaseModel, ValidationError, Field
+from engine import convert_value, compile_formula
+from extract import extract_value, ExtractedUnits
+from llm_scheduler import scheduler, llm_priority, Priority
+from utils import console, benchmark
+
+
+#Pydantic Models for the HTTP API
+class ConvertRequest(BaseModel):
+    query: str
+
+class BatchConvertRequest(BaseModel):
+    queries: list[str] = Field(min_length=1)
+
+class ClearCacheRequest(BaseModel):
+    pairs: list[tuple[str, str]] | None = None     # (from_unit, to_unit) pairs to drop, None drops everything
+
+class ConversionResponse(BaseModel):
+    query: str
+    from_unit: str | None = None
+    to_unit: str | None = None
+    formula: str | None = None
+    source: str | None = None       # "graph" if the formula was already stored, "llm" if it was learned for this query, None if no reliable formula was found
+    value: float | None = None
+    result: float | None = None
+    error: str | None = None
+
+
+class ServiceMetrics:
+    """
+    In-process counters exposed on /metrics. Only updated from the event loop, so no locking is needed.
+    """
+    def __init__(self) -> None:
+        self.started_at = time.time()
+        self.requests = 0
+        self.queries = 0
+        self.graph_hits = 0
+        self.learned = 0
+        self.failures = 0
+        self.errors = 0
+        self.total_latency = 0.0
+
+    def record(self, response: ConversionResponse, elapsed: float) -> None:
+        self.queries += 1
+        self.total_latency += elapsed
+        if response.error:
+            self.errors += 1
+        elif response.source == "graph":
+            self.graph_hits += 1
+        elif response.source == "llm":
+            self.learned += 1
+        else:
+            self.failures += 1
+
+    def to_dict(self) -> dict:
+        cache = compile_formula.cache_info()
+        return {
+            "uptime_seconds": time.time() - self.started_at,
+            "requests": self.requests,
+            "queries": self.queries,
+            "graph_hits": self.graph_hits,
+            "learned": self.learned,
+            "failures": self.failures,
+            "errors": self.errors,
+            "avg_latency_seconds": self.total_latency / self.queries if self.queries else 0.0,
+            "formula_cache": {"hits": cache.hits, "misses": cache.misses, "size": cache.currsize},
+            "llm_scheduler": scheduler.stats(),
+        }
+
+
+def convert_query(agent, query: str) -> ConversionResponse:
+    """
+    Resolves a single question to a formula (KG first, LLM learning second) and evaluates the value in it, if any.
+    Blocking: runs DSPy and Neo4j calls, so the server calls it from a worker thread.
+    """
+    response = ConversionResponse(query=query)
+
+    units: ExtractedUnits = agent.extract_units(query)
+    response.from_unit = units.from_unit
+    response.to_unit = units.to_unit
+
+    formula: str | None = agent.lookup(units)
+    source = "graph"
+
+    if not formula:
+        formula = agent.learn_formula(units)
+        source = "llm"
+
+    if not formula:
+        # Not an error: the conversion is invalid or no formula passed its tests. Reported as formula/source None
+        return response
+
+    response.formula = formula
+    response.source = source
+    response.value = extract_value(query)
+
+    if response.value is not None:
+        response.result = convert_value(formula, response.value)
+
+    return response
+
+
+def create_app(agent=None, *, max_concurrency: int = 8, max_batch_size: int = 100) -> web.Application:
+    """
+    Builds the aiohttp application around one long-lived KGAgent.
+
+    :param agent: A KGAgent (or a stub with extract_units, lookup and learn_formula). Defaults to the shared agent in user_query.
+    :param max_concurrency: Maximum number of conversions running in worker threads at once
+    :param max_batch_size: Maximum number of queries accepted by /convert/batch
+    """
+    if agent is None:
+        from user_query import agent  # Imported lazily so stubbed agents never touch DSPy/Neo4j setup
+
+    metrics = ServiceMetrics()
+    semaphore = asyncio.Semaphore(max_concurrency)
+
+    async def run_one(query: str, priority: Priority) -> ConversionResponse:
+        start = time.perf_counter()
+        async with semaphore:
+            try:
+                with llm_priority(priority):
+                    response = await asyncio.to_thread(convert_query, agent, query)
+            except Exception as e:
+                console.print(f"Conversion failed for {query!r}:", e)
+                response = ConversionResponse(query=query, error=str(e))
+        metrics.record(response, time.perf_counter() - start)
+        return response
+
+    async def parse_body(request: web.Request, model: type[BaseModel]):
+        try:
+            return model.model_validate(await request.json())
+        except (ValueError, ValidationError) as e:
+            raise web.HTTPBadRequest(text=str(e))
+
+    async def convert(request: web.Request) -> web.Response:
+        metrics.requests += 1
+        body: ConvertRequest = await parse_body(request, ConvertRequest)
+        response = await run_one(body.query, Priority.INTERACTIVE)
+        return web.json_response(response.model_dump())
+
+    async def convert_batch(request: web.Request) -> web.Response:
+        metrics.requests += 1
+        body: BatchConvertRequest = await parse_body(request, BatchConvertRequest)
+
+        if len(body.queries) > max_batch_size:
+            raise web.HTTPBadRequest(text=f"At most {max_batch_size} queries are allowed per batch, got {len(body.queries)}")
+
+        responses = await asyncio.gather(*(run_one(query, Priority.BATCH) for query in body.queries))
+        return web.json_response({"results": [r.model_dump() for r in responses]})
+
+    async def clear_cache(request: web.Request) -> web.Response:
+        from neo import clear_cache as clear_conversion_cache
+
+        body = await parse_body(request, ClearCacheRequest) if request.can_read_body else ClearCacheRequest()
+        return web.json_response({"cleared": clear_conversion_cache(body.pairs)})
+
+    async def health(request: web.Request) -> web.Response:
+        return web.json_response({"status": "ok"})
+
+    async def get_metrics(request: web.Request) -> web.Response:
+        return web.json_response(metrics.to_dict())
+
+    app = web.Application()
+    app["agent"] = agent
+    app["metrics"] = metrics
+    app.add_routes([
+        web.post("/convert", convert),
+        web.post("/convert/batch", convert_batch),
+        web.post("/cache/clear", clear_cache),
+        web.get("/health", health),
+        web.get("/metrics", get_metrics),
+    ])
+    return app
+
+
+def serve(
+    host: str = "127.0.0.1",
+    port: int = 8000,
+    max_concurrency: int = 8,
+    warm_start: str = typer.Option(None, help="Snapshot file to load into the in-process lookup cache at startup"),
+) -> None:
+    """
+    Start the conversion service with a warm agent, Neo4j driver and formula cache
+    """
+    if warm_start:
+        from snapshot import warm_start as load_snapshot
+        with benchmark("Warm start"):
+            count = load_snapshot(warm_start)
+        console.print(f"Warm start: cached {count} formulas from {warm_start}")
+
+    web.run_app(create_app(max_concurrency=max_concurrency), host=host, port=port)
+
+
+if __name__ == "__main__":
+    typer.run(serve)
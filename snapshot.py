@@ -0,0 +1,148 @@
+import gzip
+import json
+from pathlib import Path
+from typing import Iterator
+import typer
+from neo import driver, warm_cache, ConversionRelation
+from utils import console, benchmark
+
+#Graph snapshots are JSONL files (gzip-compressed when the path ends in .gz) with one record per line:
+#   {"unit": "meters"}                                                          -> a Unit node
+#   {"from_unit": "meters", "to_unit": "centimeters", "formula": "...", ...}    -> a CONVERTS_TO edge and all its properties
+
+app = typer.Typer(help="Export, import and warm-start the conversion graph from snapshot files")
+
+
+def _open(path: str | Path, mode: str):
+    path = Path(path)
+    if path.suffix == ".gz":
+        return gzip.open(path, mode + "t", encoding="utf-8")
+    return open(path, mode, encoding="utf-8")
+
+
+def read_snapshot(path: str | Path) -> Iterator[dict]:
+    """
+    Streams the raw records of a snapshot file, one dict per line.
+    """
+    with _open(path, "r") as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+
+def read_relations(path: str | Path) -> Iterator[ConversionRelation]:
+    """
+    Streams only the CONVERTS_TO edges of a snapshot as validated ConversionRelations (extras kept).
+    """
+    for record in read_snapshot(path):
+        if "from_unit" in record:
+            yield ConversionRelation.model_validate(record)
+
+
+def export_snapshot(path: str | Path) -> tuple[int, int]:
+    """
+    Dumps every Unit node and CONVERTS_TO edge to a snapshot file.
+    Returns (units_written, edges_written)
+    """
+    units = edges = 0
+    with _open(path, "w") as f, driver.session() as session:
+        for record in session.run("MATCH (u:Unit) RETURN u.name AS name"):
+            f.write(json.dumps({"unit": record["name"]}) + "\n")
+            units += 1
+
+        result = session.run("""
+            MATCH (a:Unit)-[r:CONVERTS_TO]->(b:Unit)
+            RETURN a.name AS from_unit, b.name AS to_unit, properties(r) AS props
+        """)
+        for record in result:
+            row = {"from_unit": record["from_unit"], "to_unit": record["to_unit"], **record["props"]}
+            f.write(json.dumps(row) + "\n")
+            edges += 1
+
+    return units, edges
+
+
+def _write_units(session, names: list[str]) -> None:
+    session.run("""
+        UNWIND $names AS name
+        MERGE (:Unit {name: name})
+    """, names=names)
+
+
+def _write_edges(session, rows: list[dict]) -> None:
+    session.run("""
+        UNWIND $rows AS row
+        MERGE (a:Unit {name: row.from_unit})
+        MERGE (b:Unit {name: row.to_unit})
+        MERGE (a)-[r:CONVERTS_TO]->(b)
+        SET r += row.props
+    """, rows=rows)
+
+
+def import_snapshot(path: str | Path, batch_size: int = 5000) -> tuple[int, int]:
+    """
+    Loads a snapshot into Neo4j in chunked UNWIND batches. Existing edges are merged, not duplicated.
+    Returns (units_written, edges_written)
+    """
+    units: list[str] = []
+    rows: list[dict] = []
+    unit_count = edge_count = 0
+
+    with driver.session() as session:
+        for record in read_snapshot(path):
+            if "unit" in record:
+                units.append(record["unit"])
+                if len(units) >= batch_size:
+                    _write_units(session, units)
+                    unit_count += len(units)
+                    units = []
+                continue
+
+            relation = ConversionRelation.model_validate(record)
+            props = {"formula": relation.formula, **(relation.model_extra or {})}
+            rows.append({"from_unit": relation.from_unit, "to_unit": relation.to_unit, "props": props})
+            if len(rows) >= batch_size:
+                _write_edges(session, rows)
+                edge_count += len(rows)
+                rows = []
+
+        if units:
+            _write_units(session, units)
+            unit_count += len(units)
+        if rows:
+            _write_edges(session, rows)
+            edge_count += len(rows)
+
+    return unit_count, edge_count
+
+
+def warm_start(path: str | Path) -> int:
+    """
+    Loads every formula in a snapshot into the in-process lookup cache, so lookups skip Neo4j entirely.
+    Returns the number of formulas cached.
+    """
+    return warm_cache(read_relations(path))
+
+
+@app.command("export")
+def export_command(path: str) -> None:
+    """
+    Export all Unit nodes and CONVERTS_TO edges to a JSONL snapshot (use a .gz suffix to compress)
+    """
+    with benchmark("Snapshot export"):
+        units, edges = export_snapshot(path)
+    console.print(f"Exported {units} units and {edges} conversions to {path}")
+
+
+@app.command("import")
+def import_command(path: str, batch_size: int = 5000) -> None:
+    """
+    Import a JSONL snapshot into Neo4j in batches of UNWIND writes
+    """
+    with benchmark("Snapshot import"):
+        units, edges = import_snapshot(path, batch_size=batch_size)
+    console.print(f"Imported {units} units and {edges} conversions from {path}")
+
+
+if __name__ == "__main__":
+    app()
@@ -5,6 +5,10 @@ from engine import parse_formula, evaluate_formula, normalize_variables
 from extract import TestCase
 from utils import console
 
+# Tolerances for floating point comparison, shared with the graph audit in audit.py
+DEFAULT_REL_TOL: float = 0.0
+DEFAULT_ABS_TOL: float = 1e-3   # Values are allowed to be different only after 3 decimal places
+
 class TestRunnerOutput(BaseModel):
     score: float
     failed_test_cases: List[TestCase]
@@ -14,8 +18,8 @@ def run_formula_tests(
     formula: str,
     test_cases: List[TestCase],
     *,
-    rel_tol: float = 0.0,   # Adjust these parameters for the floating point comparison
-    abs_tol: float = 1e-3,   # Values are allowed to be different only after 3 decimal places
+    rel_tol: float = DEFAULT_REL_TOL,   # Adjust these parameters for the floating point comparison
+    abs_tol: float = DEFAULT_ABS_TOL,
 ) -> TestRunnerOutput:
     """
     Runs test cases against a unit conversion formula.
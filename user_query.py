@@ -1,29 +1,53 @@
 import dspy
 from extract import ExtractUnits, ConversionValidator, AskFormula, FormulaTestCaseGenerator, ExtractedUnits, FormulaResult
+from extract import AskFormulaBatch, FormulaTestCaseBatchGenerator
 from neo import lookup_conversion, store_conversion, ConversionRelation
 from test_runner import run_formula_tests, failed_test_cases_to_markdown, TestRunnerOutput
 from utils import console
+from llm_scheduler import llm_priority, Priority
+
+#Minimum share of generated test cases a formula has to pass before it is stored in the KG
+PASS_THRESHOLD: float = 0.7
 
 #The pipeline
 class KGAgent(dspy.Module):
-    def __init__(self):
+    def __init__(self, lookup=lookup_conversion, store=store_conversion):
+        """
+        :param lookup: Callable returning the stored formula for an ExtractedUnits pair or None
+        :param store: Callable persisting a ConversionRelation into the knowledge graph
+        """
         super().__init__()
+        self.lookup = lookup
+        self.store = store
         self.extract_units = ExtractUnits()
         self.conversion_validator = ConversionValidator()
         self.ask_formula = AskFormula()
         self.test_case_generator = FormulaTestCaseGenerator()
+        self.ask_formula_batch = AskFormulaBatch()
+        self.test_case_batch_generator = FormulaTestCaseBatchGenerator()
 
     def forward(self, question: str) -> str:
         # STEP 1: Extract units
         units: ExtractedUnits= self.extract_units(question)  #An ExtractedUnits pydantic instance is returned
 
         # STEP 2: Check the knowledge graph
-        formula: str | None = lookup_conversion(units)  #Returns formula string or None
+        formula: str | None = self.lookup(units)  #Returns formula string or None
 
         #If formula is found in the KG, return it
         if formula:
             return f"Formula found in the knowledge graph: {formula}"
-        
+
+        formula = self.learn_formula(units)
+        if formula:
+            return f"I learned this rule from the LLM: {formula}"
+
+        return None
+
+    def learn_formula(self, units: ExtractedUnits) -> str | None:
+        """
+        Asks the LLM for a formula, tests it and stores it in the KG once it passes.
+        Returns the learned formula string, or None if the conversion is invalid or no reliable formula was found.
+        """
         #Initialize the loop count and feedback string
         loop_counter: int = 0
         feedback: str = ""
@@ -61,17 +85,9 @@ class KGAgent(dspy.Module):
             console.print("LLM Actual Outputs for Failed Test Cases: ", test_runner_output.actual_outputs_for_failed_test_cases)
 
             #If the score is above a certain threshold, the formula is stored in the KG (At least 8 cases have to pass) and the loop breaks
-            if(test_runner_output.score >= 0.7):
-                data = ConversionRelation.model_validate(
-                {
-                        "from_unit":units.from_unit,
-                        "to_unit": units.to_unit,
-                        "formula": result.formula,
-                        "author": "Reevan"
-                    }
-                )
-                store_conversion(data)
-                return f"I learned this rule from the LLM: {result.formula}"
+            if(test_runner_output.score >= PASS_THRESHOLD):
+                self.store_formula(units, result.formula)
+                return result.formula
 
             #Else, the feedback score is sent back to the AskFormula module for fine-tuning 
             markdown_feedback: str = failed_test_cases_to_markdown(test_runner_output.failed_test_cases, result.formula)
@@ -98,7 +114,74 @@ class KGAgent(dspy.Module):
         console.print(f"Unable to determine a reliable formula after {loop_counter} attempts.")
         return None
 
+    def store_formula(self, units: ExtractedUnits, formula: str) -> None:
+        data = ConversionRelation.model_validate(
+            {
+                "from_unit": units.from_unit,
+                "to_unit": units.to_unit,
+                "formula": formula,
+                "author": "Reevan"
+            }
+        )
+        self.store(data)
+
+    def learn_many(self, units_list: list[ExtractedUnits]) -> list[str | None]:
+        """
+        Bulk version of learn_formula for backfills. Formulas and test cases are generated for many
+        unit pairs per LLM call; every pair whose batched answer is unusable or fails its tests is
+        retried on the single-pair learn_formula path (with its feedback loop).
+        Returns the learned formula (or None) for each pair, in input order.
+        Runs at background priority, so interactive queries sharing the LLM scheduler go first.
+        """
+        with llm_priority(Priority.BACKGROUND):
+            return self._learn_many(units_list)
+
+    def _learn_many(self, units_list: list[ExtractedUnits]) -> list[str | None]:
+        learned: list[str | None] = [None] * len(units_list)
+
+        # Pairs already in the KG are not asked again
+        pending = []
+        for i, units in enumerate(units_list):
+            formula = self.lookup(units)
+            if formula:
+                learned[i] = formula
+            else:
+                pending.append(i)
+
+        formulas = self.ask_formula_batch([units_list[i] for i in pending])
+
+        # Pairs the batch judged impossible are dropped, unusable answers go to the single-pair path
+        candidates = [(i, result.formula) for i, result in zip(pending, formulas) if isinstance(result, FormulaResult)]
+        retry = [i for i, result in zip(pending, formulas) if result is None]
+        console.print(f"Batched formulas: {len(candidates)} usable, {len(retry)} to retry")
+
+        test_case_sets = self.test_case_batch_generator([formula for _, formula in candidates])
+
+        for (i, formula), test_cases in zip(candidates, test_case_sets):
+            if test_cases is None:
+                retry.append(i)
+                continue
+
+            try:
+                test_runner_output: TestRunnerOutput = run_formula_tests(
+                    formula = formula,
+                    test_cases = test_cases.test_cases
+                )
+            except Exception as e:
+                console.print(f"Could not test batched formula {formula}:", e)
+                retry.append(i)
+                continue
 
-agent = KGAgent()
+            if test_runner_output.score >= PASS_THRESHOLD:
+                self.store_formula(units_list[i], formula)
+                learned[i] = formula
+            else:
+                retry.append(i)
 
+        for i in sorted(retry):
+            learned[i] = self.learn_formula(units_list[i])
 
+        return learned
+
+
+agent = KGAgent()